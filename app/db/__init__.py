@@ -1,3 +1,4 @@
-from .database import get_db, init_db
+from .database import get_db, get_engine, get_sessionmaker, init_db, close_db
+from .cache import get_redis, close_redis
 
-__all__ = ["get_db", "init_db"]
+__all__ = ["get_db", "get_engine", "get_sessionmaker", "init_db", "close_db", "get_redis", "close_redis"]
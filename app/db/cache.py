@@ -0,0 +1,180 @@
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+from app.core import get_settings
+
+# Snapshot of active, unexpired coupons used when evaluating carts
+ACTIVE_COUPONS_KEY = "coupons:active:v1"
+
+# Total number of coupons, reported by the paginated listing
+COUPON_COUNT_KEY = "coupons:count"
+
+# Session.info entry holding cache keys to delete after the transaction commits
+PENDING_INVALIDATIONS_KEY = "pending_cache_invalidations"
+
+# IDs of coupons whose usage counter changed since the last write-back
+DIRTY_USAGE_KEY = "coupons:uses:dirty"
+
+# Atomically seed the counter from the DB value, enforce the limit and count one use.
+# The counter is raised to times_used whenever it is missing or behind: uses counted in the DB
+# while Redis was unreachable must not be handed out again once it is back.
+# KEYS: usage counter, dirty set. ARGV: times_used in DB, repetition limit (0 = none), coupon id.
+# Returns the new usage count, or -1 when the limit has been reached.
+RESERVE_USE_LUA = """
+local uses = tonumber(redis.call('GET', KEYS[1]))
+local times_used = tonumber(ARGV[1])
+if not uses or uses < times_used then
+    uses = times_used
+    redis.call('SET', KEYS[1], uses)
+end
+local limit = tonumber(ARGV[2])
+if limit > 0 and uses >= limit then
+    return -1
+end
+uses = redis.call('INCR', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[3])
+return uses
+"""
+
+
+def coupon_id_key(coupon_id: int) -> str:
+    """Cache key for a coupon looked up by ID"""
+    return f"coupon:id:{coupon_id}"
+
+
+def coupon_code_key(code: str) -> str:
+    """Cache key for a coupon looked up by code (codes are case-insensitive)"""
+    return f"coupon:code:{code.lower()}"
+
+
+def coupon_uses_key(coupon_id: int) -> str:
+    """Key of the authoritative usage counter for a coupon"""
+    return f"coupon:uses:{coupon_id}"
+
+
+@lru_cache(maxsize=1)
+def get_redis_client() -> Optional[Redis]:
+    """Build the process-wide Redis client (with its connection pool) once"""
+    settings = get_settings()
+    if not settings.redis_url:
+        return None
+    return Redis.from_url(settings.redis_url, max_connections=settings.redis_max_connections)
+
+
+async def get_redis() -> Optional[Redis]:
+    """Dependency for getting the shared Redis client, or None when caching is disabled"""
+    return get_redis_client()
+
+
+async def close_redis():
+    """Close the Redis client and its pooled connections"""
+    client = get_redis_client()
+    if client is not None:
+        await client.aclose()
+    get_redis_client.cache_clear()
+
+
+async def cache_get(cache: Optional[Redis], key: str) -> Optional[bytes]:
+    """Read a cached value; a cache outage is treated as a miss"""
+    if cache is None:
+        return None
+    try:
+        return await cache.get(key)
+    except RedisError:
+        return None
+
+
+async def cache_set(cache: Optional[Redis], key: str, value: Union[str, bytes], ttl: Optional[int] = None):
+    """Store a value with a TTL (COUPON_CACHE_TTL by default); failures are ignored so the DB stays the source of truth"""
+    if cache is None:
+        return
+    try:
+        await cache.setex(key, ttl or get_settings().coupon_cache_ttl, value)
+    except RedisError:
+        pass
+
+
+async def cache_delete(cache: Optional[Redis], *keys: str):
+    """Invalidate cached values"""
+    if cache is None or not keys:
+        return
+    try:
+        await cache.delete(*keys)
+    except RedisError:
+        pass
+
+
+def invalidate_after_commit(db: AsyncSession, cache: Optional[Redis], *keys: str):
+    """
+    Queue cache keys to be deleted once the session's transaction commits.
+    Deleting earlier would let a concurrent read re-cache the old committed row for a full TTL.
+    """
+    if cache is None or not keys:
+        return
+    db.info.setdefault(PENDING_INVALIDATIONS_KEY, []).append((cache, keys))
+
+
+async def run_pending_invalidations(db: AsyncSession):
+    """Delete the cache keys queued on the session (call right after a successful commit)"""
+    for cache, keys in db.info.pop(PENDING_INVALIDATIONS_KEY, []):
+        await cache_delete(cache, *keys)
+
+
+def discard_pending_invalidations(db: AsyncSession):
+    """Forget queued cache keys after a rollback; nothing they described was committed"""
+    db.info.pop(PENDING_INVALIDATIONS_KEY, None)
+
+
+@lru_cache(maxsize=4)
+def _reserve_use_script(cache: Redis) -> AsyncScript:
+    """Register the usage reservation script once per client (invoked via EVALSHA)"""
+    return cache.register_script(RESERVE_USE_LUA)
+
+
+async def reserve_coupon_use(
+    cache: Optional[Redis], coupon_id: int, times_used: int, repetition_limit: Optional[int]
+) -> Optional[int]:
+    """
+    Count one use of a coupon in Redis.
+    Returns the new count, -1 if the repetition limit is reached, or None if Redis is unavailable.
+    A reservation is never released: if the request fails after reserving (e.g. its commit fails),
+    that use stays counted, so the error is always towards fewer redemptions, never more.
+    """
+    if cache is None:
+        return None
+    try:
+        return await _reserve_use_script(cache)(
+            keys=[coupon_uses_key(coupon_id), DIRTY_USAGE_KEY],
+            args=[times_used, repetition_limit or 0, coupon_id]
+        )
+    except RedisError:
+        return None
+
+
+async def get_coupon_uses(cache: Optional[Redis], coupon_ids: List[int]) -> Dict[int, int]:
+    """Read the live usage counters that exist for the given coupons"""
+    if cache is None or not coupon_ids:
+        return {}
+    try:
+        values = await cache.mget([coupon_uses_key(coupon_id) for coupon_id in coupon_ids])
+    except RedisError:
+        return {}
+    return {coupon_id: int(value) for coupon_id, value in zip(coupon_ids, values) if value is not None}
+
+
+async def pop_dirty_coupon_uses(cache: Redis, batch_size: int = 500) -> Dict[int, int]:
+    """Take a batch of changed usage counters to be written back to the database"""
+    coupon_ids = [int(coupon_id) for coupon_id in await cache.spop(DIRTY_USAGE_KEY, batch_size) or []]
+    if not coupon_ids:
+        return {}
+    values = await cache.mget([coupon_uses_key(coupon_id) for coupon_id in coupon_ids])
+    return {coupon_id: int(value) for coupon_id, value in zip(coupon_ids, values) if value is not None}
+
+
+async def mark_coupon_uses_dirty(cache: Redis, coupon_ids: List[int]):
+    """Queue usage counters for another write-back attempt"""
+    if coupon_ids:
+        await cache.sadd(DIRTY_USAGE_KEY, *coupon_ids)
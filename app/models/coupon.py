@@ -1,12 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, FetchedValue, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 
 Base = declarative_base()
 
 # IST timezone
-IST = pytz.timezone('Asia/Kolkata')
+IST = ZoneInfo("Asia/Kolkata")
 
 
 def get_ist_time():
@@ -16,14 +17,29 @@ def get_ist_time():
 
 class Coupon(Base):
     __tablename__ = "coupons"
+    __table_args__ = (
+        # Serves the active/unexpired filter used when evaluating carts
+        Index("ix_coupons_active_expiry", "is_active", "expires_at"),
+        # Serves the repetition-limit (exhaustion) filter
+        Index("ix_coupons_usage", "repetition_limit", "times_used"),
+        # Serves containment (@>) lookups of product IDs inside details
+        Index("ix_coupons_details", "details", postgresql_using="gin", postgresql_ops={"details": "jsonb_path_ops"}),
+    )
+    # Return server-side values (updated_at after the trigger) from the UPDATE itself
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     code = Column(String(50), unique=True, nullable=False, index=True)  # Unique alphanumeric code
     type = Column(String, nullable=False)  # cart-wise, product-wise, bxgy
-    details = Column(JSON, nullable=False)
-    created_at = Column(DateTime, default=get_ist_time)
-    updated_at = Column(DateTime, default=get_ist_time, onupdate=get_ist_time)
-    expires_at = Column(DateTime, nullable=True)
+    details = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=get_ist_time)
+    # The setup script's update_coupons_updated_at trigger may rewrite this on UPDATE
+    updated_at = Column(DateTime(timezone=True), default=get_ist_time, onupdate=get_ist_time, server_onupdate=FetchedValue())
+    expires_at = Column(DateTime(timezone=True), nullable=True)
     is_active = Column(Boolean, default=True)
     repetition_limit = Column(Integer, nullable=True)  # Extracted from details and stored separately
     times_used = Column(Integer, default=0)
+
+
+# Functional index backing case-insensitive lookups by code
+Index("ix_coupons_code_lower", func.lower(Coupon.code))
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
+from app.models.coupon import IST
 
 
 class CouponType(str, Enum):
@@ -32,19 +33,56 @@ class BxGyDetails(BaseModel):
     repition_limit: int = Field(default=1, ge=1)
 
 
+def _split_repetition_limit(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of raw coupon input with details['repition_limit'] moved to repetition_limit"""
+    details = data.get('details')
+    if not isinstance(details, dict) or 'repition_limit' not in details:
+        return data
+    details = dict(details)
+    return {**data, 'details': details, 'repetition_limit': details.pop('repition_limit')}
+
+
+def _assume_ist(value: Optional[datetime]) -> Optional[datetime]:
+    """Read a naive timestamp as IST, the app's timezone, instead of leaving it to the server's local zone"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=IST)
+    return value
+
+
 class CouponCreate(BaseModel):
+    # Alphanumeric codes are enforced by the pattern, checked in pydantic-core
     code: str = Field(..., min_length=4, max_length=50, pattern=r'^[A-Za-z0-9]+$')
     type: CouponType
     details: Dict[str, Any]
     expires_at: Optional[datetime] = None
-    
-    @field_validator('code')
+    # Split out of details['repition_limit'] for BxGy coupons (defaults to 1), None for other types
+    repetition_limit: Optional[int] = Field(None, ge=1)
+
+    class Config:
+        use_enum_values = True  # Store the plain type string on the model
+
+    @field_validator('expires_at')
     @classmethod
-    def validate_code(cls, v: str) -> str:
-        """Ensure code is alphanumeric"""
-        if not v.isalnum():
-            raise ValueError('Coupon code must be alphanumeric (letters and numbers only)')
-        return v
+    def expires_at_in_ist(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Pin naive expiry times to IST before they reach the database"""
+        return _assume_ist(value)
+
+    @model_validator(mode='before')
+    @classmethod
+    def extract_repetition_limit(cls, data: Any) -> Any:
+        """Move the BxGy repetition limit out of details before field validation, so its constraints apply"""
+        if isinstance(data, dict) and data.get('type') == CouponType.BXGY:
+            data = _split_repetition_limit(data)
+        return data
+
+    @model_validator(mode='after')
+    def default_repetition_limit(self) -> 'CouponCreate':
+        """BxGy coupons default to a repetition limit of 1; other types have none"""
+        if self.type == CouponType.BXGY:
+            self.repetition_limit = self.repetition_limit or 1
+        else:
+            self.repetition_limit = None
+        return self
 
 
 class CouponUpdate(BaseModel):
@@ -53,15 +91,25 @@ class CouponUpdate(BaseModel):
     details: Optional[Dict[str, Any]] = None
     expires_at: Optional[datetime] = None
     is_active: Optional[bool] = None
-    
-    @field_validator('code')
+    # Split out of details['repition_limit'] when present; the service applies it to BxGy coupons only
+    repetition_limit: Optional[int] = Field(None, ge=1)
+
+    class Config:
+        use_enum_values = True  # Store the plain type string on the model
+
+    @field_validator('expires_at')
     @classmethod
-    def validate_code(cls, v: Optional[str]) -> Optional[str]:
-        """Ensure code is alphanumeric"""
-        if v is not None:
-            if not v.isalnum():
-                raise ValueError('Coupon code must be alphanumeric (letters and numbers only)')
-        return v
+    def expires_at_in_ist(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Pin naive expiry times to IST before they reach the database"""
+        return _assume_ist(value)
+
+    @model_validator(mode='before')
+    @classmethod
+    def extract_repetition_limit(cls, data: Any) -> Any:
+        """Move the repetition limit out of details before field validation, so its constraints apply"""
+        if isinstance(data, dict):
+            data = _split_repetition_limit(data)
+        return data
 
 
 class CouponResponse(BaseModel):
@@ -80,6 +128,41 @@ class CouponResponse(BaseModel):
         from_attributes = True
 
 
+class CouponSummaryResponse(BaseModel):
+    """Coupon without its details payload, for listings and stats that don't render it"""
+    id: int
+    code: str
+    type: str
+    created_at: datetime
+    updated_at: datetime
+    expires_at: Optional[datetime]
+    is_active: bool
+    repetition_limit: Optional[int]
+    times_used: int
+
+    class Config:
+        from_attributes = True
+
+
+class BulkCouponCreateResponse(BaseModel):
+    created: List[CouponResponse]
+    skipped: List[str]  # Codes that already existed (or were repeated in the request)
+
+
+class CouponStatsResponse(BaseModel):
+    coupon_id: int
+    code: str
+    type: str
+    is_active: bool
+    expires_at: Optional[datetime]
+    # Usage fields are only reported for BxGy coupons
+    times_used: Optional[int] = None
+    repetition_limit: Optional[int] = None
+    usage_percentage: Optional[float] = None
+    remaining_uses: Optional[int] = None
+    is_exhausted: Optional[bool] = None
+
+
 class CartItem(BaseModel):
     product_id: int = Field(..., gt=0)
     quantity: int = Field(..., gt=0)
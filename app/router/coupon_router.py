@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
+from typing import List, Literal, Optional, Union
 
-from app.db import get_db
+from app.db import get_db, get_redis
 from app.models.schemas import (
-    CouponCreate, CouponUpdate, CouponResponse,
+    CouponCreate, CouponUpdate, CouponResponse, CouponSummaryResponse, CouponStatsResponse,
+    BulkCouponCreateResponse,
     ApplicableCouponsRequest, ApplicableCouponsResponse,
     ApplyCouponRequest, ApplyCouponResponse
 )
@@ -12,66 +14,104 @@ from app.services import CouponService
 
 router = APIRouter(prefix="/api", tags=["coupons"])
 
+# Largest number of coupons accepted by one bulk create request
+MAX_BULK_COUPONS = 10000
+
 
 @router.post("/coupons", response_model=CouponResponse, status_code=201)
-def create_coupon(coupon: CouponCreate, db: Session = Depends(get_db)):
+async def create_coupon(
+    coupon: CouponCreate,
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
     """Create a new coupon"""
-    return CouponService.create_coupon(db, coupon)
+    return await CouponService.create_coupon(db, coupon, cache)
+
+
+@router.post("/coupons/bulk", response_model=BulkCouponCreateResponse, status_code=201)
+async def bulk_create_coupons(
+    coupons: List[CouponCreate] = Body(..., max_length=MAX_BULK_COUPONS),
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
+    """Create many coupons at once; codes that already exist are skipped"""
+    return await CouponService.bulk_create_coupons(db, coupons, cache)
 
 
-@router.get("/coupons", response_model=List[CouponResponse])
-def get_all_coupons(db: Session = Depends(get_db)):
-    """Retrieve all coupons"""
-    return CouponService.get_all_coupons(db)
+@router.get("/coupons", response_model=Union[List[CouponResponse], List[CouponSummaryResponse]])
+async def get_all_coupons(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    fields: Literal["all", "summary"] = Query("all", description="Use 'summary' to omit coupon details"),
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
+    """Retrieve a page of coupons; the total number of coupons is returned in X-Total-Count"""
+    response.headers["X-Total-Count"] = str(await CouponService.count_coupons(db, cache))
+    return await CouponService.get_all_coupons(db, limit, offset, include_details=fields == "all")
 
 
 @router.get("/coupons/{id}", response_model=CouponResponse)
-def get_coupon(id: int, db: Session = Depends(get_db)):
+async def get_coupon(id: int, db: AsyncSession = Depends(get_db), cache: Optional[Redis] = Depends(get_redis)):
     """Retrieve a specific coupon by ID"""
-    coupon = CouponService.get_coupon_by_id(db, id)
+    coupon = await CouponService.get_coupon_by_id(db, id, cache)
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     return coupon
 
 
 @router.get("/coupons/code/{code}", response_model=CouponResponse)
-def get_coupon_by_code(code: str, db: Session = Depends(get_db)):
+async def get_coupon_by_code(
+    code: str,
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
     """Retrieve a specific coupon by code"""
-    coupon = CouponService.get_coupon_by_code(db, code)
+    coupon = await CouponService.get_coupon_by_code(db, code, cache)
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     return coupon
 
 
 @router.put("/coupons/{id}", response_model=CouponResponse)
-def update_coupon(id: int, coupon: CouponUpdate, db: Session = Depends(get_db)):
+async def update_coupon(
+    id: int,
+    coupon: CouponUpdate,
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
     """Update a specific coupon by ID"""
-    updated_coupon = CouponService.update_coupon(db, id, coupon)
+    updated_coupon = await CouponService.update_coupon(db, id, coupon, cache)
     if not updated_coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     return updated_coupon
 
 
 @router.delete("/coupons/{id}", status_code=204)
-def delete_coupon(id: int, db: Session = Depends(get_db)):
+async def delete_coupon(id: int, db: AsyncSession = Depends(get_db), cache: Optional[Redis] = Depends(get_redis)):
     """Delete a specific coupon by ID"""
-    success = CouponService.delete_coupon(db, id)
+    success = await CouponService.delete_coupon(db, id, cache)
     if not success:
         raise HTTPException(status_code=404, detail="Coupon not found")
     return None
 
 
 @router.post("/applicable-coupons", response_model=ApplicableCouponsResponse)
-def get_applicable_coupons(request: ApplicableCouponsRequest, db: Session = Depends(get_db)):
+async def get_applicable_coupons(
+    request: ApplicableCouponsRequest,
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
     """Fetch all applicable coupons for a given cart"""
-    applicable = CouponService.get_applicable_coupons(db, request.cart)
+    applicable = await CouponService.get_applicable_coupons(db, request.cart, cache)
     return ApplicableCouponsResponse(applicable_coupons=applicable)
 
 
-@router.get("/coupons/{id}/stats")
-def get_coupon_stats(id: int, db: Session = Depends(get_db)):
+@router.get("/coupons/{id}/stats", response_model=CouponStatsResponse, response_model_exclude_unset=True)
+async def get_coupon_stats(id: int, db: AsyncSession = Depends(get_db), cache: Optional[Redis] = Depends(get_redis)):
     """Get coupon usage statistics"""
-    coupon = CouponService.get_coupon_by_id(db, id)
+    coupon = await CouponService.get_coupon_summary(db, id, cache)
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     
@@ -86,23 +126,29 @@ def get_coupon_stats(id: int, db: Session = Depends(get_db)):
     
     # Add repetition_limit stats only for BxGy coupons
     if coupon.type == "bxgy":
+        times_used = await CouponService.get_times_used(coupon, cache)
         usage_percentage = 0
         if coupon.repetition_limit:
-            usage_percentage = (coupon.times_used / coupon.repetition_limit) * 100
+            usage_percentage = (times_used / coupon.repetition_limit) * 100
         
         response.update({
-            "times_used": coupon.times_used,
+            "times_used": times_used,
             "repetition_limit": coupon.repetition_limit,
             "usage_percentage": round(usage_percentage, 2),
-            "remaining_uses": coupon.repetition_limit - coupon.times_used if coupon.repetition_limit else None,
-            "is_exhausted": coupon.repetition_limit and coupon.times_used >= coupon.repetition_limit
+            "remaining_uses": coupon.repetition_limit - times_used if coupon.repetition_limit else None,
+            "is_exhausted": coupon.repetition_limit and times_used >= coupon.repetition_limit
         })
     
     return response
 
 
 @router.post("/apply-coupon/{id}", response_model=ApplyCouponResponse)
-def apply_coupon(id: int, request: ApplyCouponRequest, db: Session = Depends(get_db)):
+async def apply_coupon(
+    id: int,
+    request: ApplyCouponRequest,
+    db: AsyncSession = Depends(get_db),
+    cache: Optional[Redis] = Depends(get_redis)
+):
     """Apply a specific coupon to the cart by ID"""
-    updated_cart = CouponService.apply_coupon(db, id, request.cart)
+    updated_cart = await CouponService.apply_coupon(db, id, request.cart, cache)
     return ApplyCouponResponse(updated_cart=updated_cart)
@@ -50,9 +50,13 @@ CREATE TABLE coupons (
 
 -- Create indexes for better query performance
 CREATE INDEX idx_coupons_code ON coupons(code);
+CREATE INDEX idx_coupons_code_lower ON coupons(LOWER(code));
 CREATE INDEX idx_coupons_type ON coupons(type);
 CREATE INDEX idx_coupons_is_active ON coupons(is_active);
 CREATE INDEX idx_coupons_expires_at ON coupons(expires_at);
+CREATE INDEX idx_coupons_active_expiry ON coupons(is_active, expires_at);
+CREATE INDEX idx_coupons_usage ON coupons(repetition_limit, times_used);
+CREATE INDEX idx_coupons_details ON coupons USING GIN (details jsonb_path_ops);
 
 -- Create function to automatically update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
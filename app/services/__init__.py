@@ -1,3 +1,4 @@
 from .coupon_service import CouponService
+from .usage_sync import flush_usage_counters, run_usage_flusher
 
-__all__ = ["CouponService"]
+__all__ = ["CouponService", "flush_usage_counters", "run_usage_flusher"]
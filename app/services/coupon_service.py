@@ -1,282 +1,798 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, select, update, or_, and_, func, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
+from app.db.cache import (
+    cache_get, cache_set, invalidate_after_commit, coupon_id_key, coupon_code_key, coupon_uses_key,
+    reserve_coupon_use, get_coupon_uses, pop_dirty_coupon_uses, mark_coupon_uses_dirty,
+    ACTIVE_COUPONS_KEY, COUPON_COUNT_KEY
+)
+from app.core import get_settings
 from app.models.coupon import Coupon, get_ist_time
 from app.models.schemas import (
-    CouponCreate, CouponUpdate, Cart, ApplicableCoupon,
+    CouponCreate, CouponUpdate, CouponResponse, CouponSummaryResponse, BulkCouponCreateResponse, Cart, CartItem, ApplicableCoupon,
     UpdatedCart, UpdatedCartItem
 )
-from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from fastapi import HTTPException
-import pytz
+import numpy as np
+import orjson
+
+
+# PostgreSQL SQLSTATE for unique_violation (raised by the UNIQUE constraint on coupons.code)
+UNIQUE_VIOLATION = "23505"
+
+# Columns kept in the cached active-coupon snapshot
+ACTIVE_COUPON_FIELDS = ("id", "type", "details", "expires_at", "repetition_limit", "times_used")
+ACTIVE_COUPON_COLUMNS = tuple(getattr(Coupon, field) for field in ACTIVE_COUPON_FIELDS)
+
+# Coupon timestamps, reported in UTC
+TIMESTAMP_FIELDS = ("created_at", "updated_at", "expires_at")
+
+# Cart contents as (product_id, quantity, price) tuples, in cart order
+CartKey = Tuple[Tuple[int, int, float], ...]
+
+class CouponColumns(NamedTuple):
+    """Columnar view of a coupon list: vectorizable rules as arrays, BxGy rules by key"""
+    cart_wise: np.ndarray  # Positions of cart-wise coupons in the list
+    thresholds: np.ndarray
+    cart_wise_percents: np.ndarray
+    product_wise: np.ndarray  # Positions of product-wise coupons in the list
+    product_ids: np.ndarray
+    product_wise_percents: np.ndarray
+    bxgy: Tuple[Tuple[int, bytes], ...]  # (position, rule key) of BxGy coupons
+    others: Tuple[int, ...]  # Positions of malformed rules (see _malformed_rule_discount)
+
+
+def _is_number(value: Any) -> bool:
+    """True for int/float rule parameters (bool excluded)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Express a timestamp in UTC (naive values are read as host-local time, as asyncpg stores them)"""
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc)
+
+
+class BxgyRule(NamedTuple):
+    """A BxGy rule's buy/get product lists unpacked into aligned arrays"""
+    buy_ids: List[int]
+    required: np.ndarray
+    get_ids: List[int]
+    free_qty_per_set: np.ndarray
+    coupon_prices: List[Optional[float]]  # Fallback prices from the coupon definition
+    repetition_limit: int
+
+
+class BxgyPlan(NamedTuple):
+    """A BxGy rule evaluated against one cart"""
+    buy_sets: int
+    discount: float
+    free_items: Tuple[Tuple[int, int, Optional[float]], ...]  # (product_id, free quantity, price)
+
+
+# Rows per multi-row INSERT in bulk creation (9 bind parameters per row; asyncpg allows 32767)
+BULK_INSERT_BATCH_SIZE = 1000
+
+# Number of (snapshot, cart) discount evaluations memoized per process
+APPLICABLE_CACHE_SIZE = 4096
+
+# Columns loaded when a coupon's details JSON isn't needed (listings with fields=summary, stats)
+SUMMARY_COLUMNS = tuple(getattr(Coupon, field) for field in CouponSummaryResponse.model_fields)
 
 
 class CouponService:
     """Service layer for coupon business logic"""
 
     @staticmethod
-    def create_coupon(db: Session, coupon_data: CouponCreate) -> Coupon:
+    async def create_coupon(
+        db: AsyncSession, coupon_data: CouponCreate, cache: Optional[Redis] = None
+    ) -> CouponResponse:
         """Create a new coupon"""
         try:
-            # Check if code already exists
-            existing = db.query(Coupon).filter(Coupon.code == coupon_data.code).first()
-            if existing:
-                raise HTTPException(status_code=400, detail=f"Coupon code '{coupon_data.code}' already exists")
-            
-            # Extract repetition_limit from details only for BxGy coupons
-            details = coupon_data.details.copy()
-            repetition_limit = None
-            
-            if coupon_data.type == "bxgy":
-                # Default to 1 if not provided for BxGy
-                repetition_limit = details.pop('repition_limit', 1)
-            
-            # Set expiry to 1 day from now if not provided
-            expires_at = coupon_data.expires_at
-            if expires_at is None:
-                expires_at = get_ist_time() + timedelta(days=1)
-            
-            coupon = Coupon(
-                code=coupon_data.code,
-                type=coupon_data.type,
-                details=details,
-                expires_at=expires_at,
-                repetition_limit=repetition_limit
-            )
+            coupon = Coupon(**CouponService._coupon_values(coupon_data))
             db.add(coupon)
-            db.flush()  # Flush to get the ID without committing
-            db.refresh(coupon)
-            return coupon
+            try:
+                await db.flush()  # Flush to get the ID without committing
+            except IntegrityError as e:
+                # The UNIQUE constraint on code rejects duplicates atomically
+                if CouponService._is_unique_violation(e):
+                    raise HTTPException(status_code=400, detail=f"Coupon code '{coupon_data.code}' already exists")
+                raise
+            CouponService._invalidate_coupon_cache(db, cache, coupon.id, coupon.code)
+            return CouponService._to_response(coupon)
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     @staticmethod
-    def get_all_coupons(db: Session) -> List[Coupon]:
-        """Retrieve all coupons"""
+    async def bulk_create_coupons(
+        db: AsyncSession, coupons_data: List[CouponCreate], cache: Optional[Redis] = None
+    ) -> BulkCouponCreateResponse:
+        """Create many coupons with batched multi-row INSERTs, skipping codes that already exist"""
+        if not coupons_data:
+            return BulkCouponCreateResponse(created=[], skipped=[])
+
+        created = []
+        try:
+            # One multi-row VALUES statement binds a parameter per column per row, so large imports
+            # are split to stay under the driver's bind-parameter limit
+            for start in range(0, len(coupons_data), BULK_INSERT_BATCH_SIZE):
+                batch = coupons_data[start:start + BULK_INSERT_BATCH_SIZE]
+                stmt = (
+                    pg_insert(Coupon)
+                    .values([CouponService._coupon_values(coupon_data) for coupon_data in batch])
+                    .on_conflict_do_nothing(index_elements=[Coupon.code])
+                    .returning(*Coupon.__table__.columns)
+                )
+                rows = (await db.execute(stmt)).all()
+                created.extend(CouponResponse.model_construct(**row._mapping) for row in rows)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+        if created:
+            invalidate_after_commit(db, cache, ACTIVE_COUPONS_KEY, COUPON_COUNT_KEY)
+        return BulkCouponCreateResponse(
+            created=created, skipped=CouponService._skipped_codes(coupons_data, created)
+        )
+
+    @staticmethod
+    def _skipped_codes(coupons_data: List[CouponCreate], created: List[CouponResponse]) -> List[str]:
+        """Requested codes that weren't inserted, in request order"""
+        # Each inserted code accounts for its first occurrence; every other entry was skipped
+        inserted_codes = {coupon.code for coupon in created}
+        skipped = []
+        for coupon_data in coupons_data:
+            if coupon_data.code in inserted_codes:
+                inserted_codes.discard(coupon_data.code)
+            else:
+                skipped.append(coupon_data.code)
+        return skipped
+
+    @staticmethod
+    async def get_all_coupons(
+        db: AsyncSession, limit: int = 50, offset: int = 0, include_details: bool = True
+    ) -> Union[List[CouponResponse], List[CouponSummaryResponse]]:
+        """Retrieve a page of coupons ordered by ID, optionally without the details JSON"""
+        try:
+            if not include_details:
+                rows = (await db.execute(
+                    select(*SUMMARY_COLUMNS).order_by(Coupon.id).limit(limit).offset(offset)
+                )).all()
+                return [CouponSummaryResponse.model_construct(**row._mapping) for row in rows]
+
+            coupons = (await db.execute(
+                select(Coupon).order_by(Coupon.id).limit(limit).offset(offset)
+            )).scalars().all()
+            return [CouponService._to_response(coupon) for coupon in coupons]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    @staticmethod
+    async def count_coupons(db: AsyncSession, cache: Optional[Redis] = None) -> int:
+        """Count all coupons (cached so paging through the list doesn't rescan the table)"""
         try:
-            return db.query(Coupon).all()
+            cached = await cache_get(cache, COUPON_COUNT_KEY)
+            if cached is not None:
+                return int(cached)
+
+            total = (await db.execute(select(func.count()).select_from(Coupon))).scalar_one()
+            await cache_set(cache, COUPON_COUNT_KEY, str(total))
+            return total
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     @staticmethod
-    def get_coupon_by_id(db: Session, coupon_id: int) -> Optional[Coupon]:
-        """Retrieve a specific coupon by ID"""
+    async def get_coupon_by_id(
+        db: AsyncSession, coupon_id: int, cache: Optional[Redis] = None
+    ) -> Optional[CouponResponse]:
+        """Retrieve a specific coupon by ID (read-through cached when Redis is configured)"""
+        key = coupon_id_key(coupon_id)
+        cached = await cache_get(cache, key)
+        if cached is not None:
+            return CouponResponse.model_validate_json(cached)
+
         try:
-            return db.query(Coupon).filter(Coupon.id == coupon_id).first()
+            coupon = await db.get(Coupon, coupon_id)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+        if coupon is None:
+            return None
+        response = CouponService._to_response(coupon)
+        await CouponService._cache_coupon(cache, key, response)
+        return response
     
     @staticmethod
-    def get_coupon_by_code(db: Session, code: str) -> Optional[Coupon]:
-        """Retrieve a specific coupon by code (case-insensitive)"""
+    async def get_coupon_summary(
+        db: AsyncSession, coupon_id: int, cache: Optional[Redis] = None
+    ) -> Optional[Union[CouponResponse, CouponSummaryResponse]]:
+        """Retrieve a coupon without loading its details JSON (a cached full coupon is reused when present)"""
+        cached = await cache_get(cache, coupon_id_key(coupon_id))
+        if cached is not None:
+            return CouponResponse.model_validate_json(cached)
+
+        try:
+            row = (await db.execute(
+                select(*SUMMARY_COLUMNS).where(Coupon.id == coupon_id)
+            )).one_or_none()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+        if row is None:
+            return None
+        return CouponSummaryResponse.model_construct(**row._mapping)
+
+    @staticmethod
+    async def get_coupon_by_code(
+        db: AsyncSession, code: str, cache: Optional[Redis] = None
+    ) -> Optional[CouponResponse]:
+        """Retrieve a specific coupon by code (case-insensitive, read-through cached when Redis is configured)"""
+        key = coupon_code_key(code)
+        cached = await cache_get(cache, key)
+        if cached is not None:
+            return CouponResponse.model_validate_json(cached)
+
         try:
-            return db.query(Coupon).filter(Coupon.code.ilike(code)).first()
+            coupon = (await db.execute(
+                select(Coupon).where(func.lower(Coupon.code) == code.lower())
+            )).scalars().first()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+        if coupon is None:
+            return None
+        response = CouponService._to_response(coupon)
+        await CouponService._cache_coupon(cache, key, response)
+        return response
+
     @staticmethod
-    def update_coupon(db: Session, coupon_id: int, coupon_data: CouponUpdate) -> Optional[Coupon]:
+    async def update_coupon(
+        db: AsyncSession, coupon_id: int, coupon_data: CouponUpdate, cache: Optional[Redis] = None
+    ) -> Optional[CouponResponse]:
         """Update a specific coupon"""
         try:
-            coupon = db.query(Coupon).filter(Coupon.id == coupon_id).first()
+            coupon = await db.get(Coupon, coupon_id)
             if not coupon:
                 return None
 
             update_data = coupon_data.model_dump(exclude_unset=True)
+            previous_code = coupon.code
             
-            # Check if code is being updated and if it already exists
-            if 'code' in update_data:
-                existing = db.query(Coupon).filter(
-                    Coupon.code == update_data['code'],
-                    Coupon.id != coupon_id
-                ).first()
-                if existing:
-                    raise HTTPException(status_code=400, detail=f"Coupon code '{update_data['code']}' already exists")
-            
-            # Extract repetition_limit from details only for BxGy coupons
-            if 'details' in update_data and update_data['details']:
-                details = update_data['details'].copy()
-                
-                # Only extract repition_limit if coupon type is bxgy
-                if coupon.type == "bxgy":
-                    # Default to 1 if not provided for BxGy
-                    repetition_limit = details.pop('repition_limit', 1)
-                    update_data['repetition_limit'] = repetition_limit
-                else:
-                    # For cart-wise and product-wise, ensure repetition_limit is None
-                    update_data['repetition_limit'] = None
-                
-                update_data['details'] = details
+            # repition_limit was split out of details by the schema; it only applies to BxGy coupons,
+            # judged by the type the coupon has after this update
+            new_type = update_data.get('type') or coupon.type
+            repetition_limit = update_data.pop('repetition_limit', None)
+            if update_data.get('details'):
+                # Default to 1 for BxGy; cart-wise and product-wise coupons have no limit
+                update_data['repetition_limit'] = (repetition_limit or 1) if new_type == "bxgy" else None
+            elif repetition_limit is not None:
+                # A limit sent on its own changes just the limit
+                if new_type != "bxgy":
+                    raise HTTPException(status_code=400, detail="repetition_limit only applies to BxGy coupons")
+                update_data['repetition_limit'] = repetition_limit
+            elif new_type != coupon.type:
+                # Changing type alone resets the limit to the new type's default
+                update_data['repetition_limit'] = 1 if new_type == "bxgy" else None
             
             for field, value in update_data.items():
                 setattr(coupon, field, value)
 
-            coupon.updated_at = get_ist_time()
-            db.flush()  # Flush changes without committing
-            db.refresh(coupon)
-            return coupon
+            # Set in SQL so the UPDATE returns the stored value (a trigger may rewrite it)
+            coupon.updated_at = func.now()
+            try:
+                await db.flush()  # Flush changes without committing
+            except IntegrityError as e:
+                # A code clash with another coupon is rejected by the UNIQUE constraint
+                if CouponService._is_unique_violation(e):
+                    raise HTTPException(status_code=400, detail=f"Coupon code '{update_data['code']}' already exists")
+                raise
+            CouponService._invalidate_coupon_cache(db, cache, coupon.id, previous_code, coupon.code)
+            return CouponService._to_response(coupon)
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     @staticmethod
-    def delete_coupon(db: Session, coupon_id: int) -> bool:
+    async def delete_coupon(db: AsyncSession, coupon_id: int, cache: Optional[Redis] = None) -> bool:
         """Delete a specific coupon"""
         try:
-            coupon = db.query(Coupon).filter(Coupon.id == coupon_id).first()
+            coupon = await db.get(Coupon, coupon_id)
             if not coupon:
                 return False
 
-            db.delete(coupon)
-            db.flush()  # Flush deletion without committing
+            await db.delete(coupon)
+            await db.flush()  # Flush deletion without committing
+            CouponService._invalidate_coupon_cache(db, cache, coupon.id, coupon.code)
+            invalidate_after_commit(db, cache, coupon_uses_key(coupon.id))
             return True
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     @staticmethod
-    def _is_coupon_valid(coupon: Coupon) -> bool:
+    def _coupon_values(coupon_data: CouponCreate) -> Dict[str, Any]:
+        """Column values for a new coupon"""
+        # Set expiry to 1 day from now if not provided
+        expires_at = coupon_data.expires_at
+        if expires_at is None:
+            expires_at = get_ist_time() + timedelta(days=1)
+        
+        return {
+            "code": coupon_data.code,
+            "type": coupon_data.type,
+            "details": coupon_data.details,
+            "expires_at": expires_at,
+            "repetition_limit": coupon_data.repetition_limit  # Already split out of details by the schema
+        }
+
+    @staticmethod
+    def _is_unique_violation(error: IntegrityError) -> bool:
+        """Check whether an IntegrityError came from a UNIQUE constraint"""
+        return getattr(error.orig, "sqlstate", None) == UNIQUE_VIOLATION
+
+    @staticmethod
+    def _to_response(coupon: Coupon) -> CouponResponse:
+        """Wrap a loaded coupon row in its response model without re-validating trusted DB data"""
+        values = {field: getattr(coupon, field) for field in CouponResponse.model_fields}
+        # Freshly written rows still hold the in-memory IST values; report them in UTC,
+        # as they read back from the database
+        for field in TIMESTAMP_FIELDS:
+            values[field] = _as_utc(values[field])
+        return CouponResponse.model_construct(**values)
+
+    @staticmethod
+    async def _cache_coupon(cache: Optional[Redis], key: str, coupon: CouponResponse):
+        """Store the serialized coupon under the given cache key"""
+        if cache is None:
+            return
+        await cache_set(cache, key, coupon.model_dump_json())
+
+    @staticmethod
+    def _invalidate_coupon_cache(db: AsyncSession, cache: Optional[Redis], coupon_id: int, *codes: str):
+        """Drop cached lookups, the active-coupon snapshot and the count once a create, update or delete commits"""
+        invalidate_after_commit(
+            db, cache, coupon_id_key(coupon_id), ACTIVE_COUPONS_KEY, COUPON_COUNT_KEY,
+            *{coupon_code_key(code) for code in codes}
+        )
+
+    @staticmethod
+    def _coupon_from_snapshot(row: Dict[str, Any]) -> Coupon:
+        """Rebuild a detached coupon from a cached snapshot entry"""
+        expires_at = row["expires_at"]
+        if expires_at is not None:
+            row = {**row, "expires_at": datetime.fromisoformat(expires_at)}
+        # Only active coupons are snapshotted
+        return Coupon(**row, is_active=True)
+
+    @staticmethod
+    async def _get_active_coupons(
+        db: AsyncSession, cache: Optional[Redis] = None, product_ids: Optional[List[int]] = None
+    ) -> Tuple[Union[Coupon, Row], ...]:
+        """
+        Load usable coupons (active, unexpired, not exhausted), served from a short-lived Redis snapshot when available.
+        Without Redis, coupons that cannot match a cart with the given product_ids are dropped in SQL as well.
+        """
+        cached = await cache_get(cache, ACTIVE_COUPONS_KEY)
+        if cached is not None:
+            return CouponService._snapshot_coupons(cached)
+
+        # Only the columns the snapshot and the validity/discount checks read, as plain rows
+        stmt = select(*ACTIVE_COUPON_COLUMNS, Coupon.is_active).where(
+            Coupon.is_active.is_(True),
+            or_(Coupon.expires_at.is_(None), Coupon.expires_at > func.now()),
+            or_(Coupon.repetition_limit.is_(None), Coupon.times_used < Coupon.repetition_limit)
+        )
+        # The snapshot is shared by all carts, so only narrow the query when there is none to fill
+        if cache is None and product_ids is not None:
+            stmt = stmt.where(CouponService._cart_candidates(product_ids))
+        coupons = (await db.execute(stmt)).all()
+        if cache is None:
+            return tuple(coupons)
+
+        snapshot = orjson.dumps([
+            {field: getattr(coupon, field) for field in ACTIVE_COUPON_FIELDS}
+            for coupon in coupons
+        ])
+        await cache_set(cache, ACTIVE_COUPONS_KEY, snapshot, get_settings().active_coupons_ttl)
+        # Hand out the same parsed objects that later snapshot hits return
+        return CouponService._snapshot_coupons(snapshot)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _snapshot_coupons(snapshot: bytes) -> Tuple[Coupon, ...]:
+        """Parse the active-coupon snapshot, reusing the previous result while its contents are unchanged"""
+        # Memoized discounts are keyed on the parsed snapshot: once it is replaced they can never hit
+        # again, and keeping them would pin every old snapshot in memory
+        CouponService._memoized_cart_discounts.cache_clear()
+        return tuple(CouponService._coupon_from_snapshot(row) for row in orjson.loads(snapshot))
+
+    @staticmethod
+    def _cart_candidates(product_ids: List[int]):
+        """SQL predicate keeping cart-wise coupons and product-wise/BxGy coupons that reference a product in the cart"""
+        if not product_ids:
+            return Coupon.type == "cart-wise"
+        return or_(
+            Coupon.type == "cart-wise",
+            and_(
+                Coupon.type == "product-wise",
+                or_(*[Coupon.details.contains({"product_id": product_id}) for product_id in product_ids])
+            ),
+            and_(
+                Coupon.type == "bxgy",
+                or_(*[
+                    Coupon.details.contains({"buy_products": [{"product_id": product_id}]})
+                    for product_id in product_ids
+                ])
+            )
+        )
+
+    @staticmethod
+    async def get_times_used(coupon: Union[CouponResponse, CouponSummaryResponse], cache: Optional[Redis] = None) -> int:
+        """Current usage count, preferring the live Redis counter over the last value written back"""
+        uses = await get_coupon_uses(cache, [coupon.id])
+        return max(uses.get(coupon.id, 0), coupon.times_used)
+
+    @staticmethod
+    async def flush_usage_counters(db: AsyncSession, cache: Redis) -> int:
+        """
+        Write a batch of Redis usage counters back to coupons.times_used and commit.
+        Returns the number of coupons written; failed batches are queued again.
+        """
+        uses = await pop_dirty_coupon_uses(cache)
+        if not uses:
+            return 0
+
+        coupons = Coupon.__table__
+        try:
+            await db.execute(
+                update(coupons)
+                .where(coupons.c.id == bindparam("coupon_id"))
+                .values(times_used=func.greatest(coupons.c.times_used, bindparam("uses"))),
+                [{"coupon_id": coupon_id, "uses": count} for coupon_id, count in uses.items()]
+            )
+            await db.commit()
+        except Exception:
+            await mark_coupon_uses_dirty(cache, list(uses))
+            raise
+        return len(uses)
+
+    @staticmethod
+    async def _record_coupon_use(
+        db: AsyncSession, coupon: Coupon, cache: Optional[Redis] = None, now: Optional[datetime] = None
+    ):
+        """Count one application of the coupon, atomically in Redis when available, otherwise on the row"""
+        uses = await reserve_coupon_use(cache, coupon.id, coupon.times_used, coupon.repetition_limit)
+        if uses is not None:
+            if uses < 0:
+                raise HTTPException(status_code=400, detail="Coupon is not valid or has expired")
+            return
+
+        try:
+            # Increment usage counter in one statement that re-checks validity, so concurrent
+            # applications can't push times_used past the repetition limit
+            result = await db.execute(
+                update(Coupon)
+                .where(
+                    Coupon.id == coupon.id,
+                    Coupon.is_active.is_(True),
+                    or_(Coupon.expires_at.is_(None), Coupon.expires_at >= (now or get_ist_time())),
+                    or_(Coupon.repetition_limit.is_(None), Coupon.times_used < Coupon.repetition_limit)
+                )
+                .values(times_used=Coupon.times_used + 1)
+                .execution_options(synchronize_session=False)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+        if result.rowcount == 0:
+            raise HTTPException(status_code=400, detail="Coupon is not valid or has expired")
+        invalidate_after_commit(db, cache, coupon_id_key(coupon.id), coupon_code_key(coupon.code))
+
+    @staticmethod
+    def _is_coupon_valid(
+        coupon: Coupon, times_used: Optional[int] = None, now: Optional[datetime] = None
+    ) -> bool:
         """Check if coupon is valid (active, not expired, usage limit not reached)"""
         if not coupon.is_active:
             return False
 
-        if coupon.expires_at and coupon.expires_at < datetime.utcnow():
+        if coupon.expires_at and coupon.expires_at < (now or get_ist_time()):
             return False
 
-        if coupon.repetition_limit and coupon.times_used >= coupon.repetition_limit:
+        if times_used is None:
+            times_used = coupon.times_used
+        if coupon.repetition_limit and times_used >= coupon.repetition_limit:
             return False
 
         return True
 
     @staticmethod
-    def _calculate_cart_total(cart: Cart) -> float:
-        """Calculate total cart value"""
-        return sum(item.price * item.quantity for item in cart.items)
+    def _cart_arrays(cart: Cart) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Build parallel (product_ids, prices, quantities) arrays for the cart items"""
+        count = len(cart.items)
+        product_ids = np.fromiter((item.product_id for item in cart.items), dtype=np.int64, count=count)
+        prices = np.fromiter((item.price for item in cart.items), dtype=np.float64, count=count)
+        quantities = np.fromiter((item.quantity for item in cart.items), dtype=np.int64, count=count)
+        return product_ids, prices, quantities
 
     @staticmethod
-    def _calculate_cart_wise_discount(cart: Cart, details: Dict) -> float:
-        """Calculate discount for cart-wise coupon"""
-        threshold = details.get("threshold", 0)
-        discount_percent = details.get("discount", 0)
-
-        cart_total = CouponService._calculate_cart_total(cart)
+    def _cart_total(item_totals: np.ndarray) -> float:
+        """
+        Cart total from the line totals, summed left to right in Python so every endpoint
+        sees the same float (a BLAS dot or numpy's pairwise sum can differ in the last bits,
+        which flips threshold checks)
+        """
+        return sum(item_totals.tolist())
 
-        if cart_total >= threshold:
-            return (cart_total * discount_percent) / 100
-        return 0.0
+    @staticmethod
+    def _build_cart_map(cart: Cart) -> Dict[int, CartItem]:
+        """Index cart items by product ID for O(1) lookups"""
+        return {item.product_id: item for item in cart.items}
 
     @staticmethod
-    def _calculate_product_wise_discount(cart: Cart, details: Dict) -> float:
-        """Calculate discount for product-wise coupon"""
-        product_id = details.get("product_id")
-        discount_percent = details.get("discount", 0)
+    def _bxgy_rule_key(details: Dict, repetition_limit: int) -> bytes:
+        """Hashable signature of a BxGy rule; changes whenever the coupon's rule does"""
+        return orjson.dumps([details, repetition_limit])
 
-        # Create cart lookup for O(1) access
-        cart_map = {item.product_id: item for item in cart.items}
-        
-        if product_id in cart_map:
-            item = cart_map[product_id]
-            return (item.price * item.quantity * discount_percent) / 100
-        
-        return 0.0
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _bxgy_rule(rule_key: bytes) -> BxgyRule:
+        """Unpack a BxGy rule's buy/get product lists into arrays once"""
+        details, repetition_limit = orjson.loads(rule_key)
+        buy_products = details.get("buy_products", [])
+        get_products = details.get("get_products", [])
+        return BxgyRule(
+            buy_ids=[buy_prod.get("product_id") for buy_prod in buy_products],
+            required=np.array([buy_prod.get("quantity") for buy_prod in buy_products], dtype=np.int64),
+            get_ids=[get_prod.get("product_id") for get_prod in get_products],
+            free_qty_per_set=np.array([get_prod.get("quantity") for get_prod in get_products], dtype=np.int64),
+            coupon_prices=[get_prod.get("price") for get_prod in get_products],
+            repetition_limit=repetition_limit
+        )
 
     @staticmethod
-    def _calculate_bxgy_discount(cart: Cart, details: Dict, repetition_limit: int = 1) -> float:
+    @lru_cache(maxsize=APPLICABLE_CACHE_SIZE)
+    def _compute_bxgy_plan(cart_key: CartKey, rule_key: bytes) -> BxgyPlan:
         """
-        Calculate discount for BxGy coupon
+        Buy sets, free quantities and discount of a BxGy rule for a cart, memoized so listing
+        applicable coupons and then applying one does the decomposition once
         Buy products work with OR logic - any combination counts toward total sets
         Example: Buy 3 from [X,Y,Z] means 3X OR 3Y OR 3Z OR any combination
         """
-        buy_products = details.get("buy_products", [])
-        get_products = details.get("get_products", [])
-
-        cart_map = {item.product_id: item for item in cart.items}
+        rule = CouponService._bxgy_rule(rule_key)
+        cart_map = {
+            product_id: CartItem.model_construct(product_id=product_id, quantity=quantity, price=price)
+            for product_id, quantity, price in cart_key
+        }
 
         # Calculate total sets available from all buy products (OR logic)
-        total_buy_sets = 0
-        for buy_prod in buy_products:
-            prod_id = buy_prod.get("product_id")
-            required_qty = buy_prod.get("quantity")
-            
-            if prod_id in cart_map:
-                sets_from_this_product = cart_map[prod_id].quantity // required_qty
-                total_buy_sets += sets_from_this_product
-        
-        if total_buy_sets == 0:
-            return 0.0
-        
+        total_buy_sets = CouponService._count_buy_sets(cart_map, rule.buy_ids, rule.required)
+        if total_buy_sets == 0 or not rule.get_ids:
+            return BxgyPlan(buy_sets=total_buy_sets, discount=0.0, free_items=())
+
         # Apply repetition limit
-        applicable_times = min(total_buy_sets, repetition_limit)
+        applicable_times = min(total_buy_sets, rule.repetition_limit)
+        free_qty = rule.free_qty_per_set * applicable_times
+
+        # Get price from cart if available, otherwise from coupon definition
+        items = [cart_map.get(product_id) for product_id in rule.get_ids]
+        prices = [
+            item.price if item is not None else price for item, price in zip(items, rule.coupon_prices)
+        ]
+
+        # The discount caps the free quantity by the cart quantity when the product is in the cart
+        # (unpriced products are skipped)
+        in_cart = np.array([item is not None for item in items], dtype=bool)
+        cart_qty = np.array([item.quantity if item is not None else 0 for item in items], dtype=np.int64)
+        actual_free_qty = np.where(in_cart, np.minimum(free_qty, cart_qty), free_qty)
+        discount = float((np.array([price or 0.0 for price in prices], dtype=np.float64) * actual_free_qty).sum())
+
+        return BxgyPlan(
+            buy_sets=total_buy_sets,
+            discount=discount,
+            free_items=tuple(zip(rule.get_ids, free_qty.tolist(), prices))
+        )
 
-        # Calculate discount for free products
-        total_discount = 0.0
-        for get_prod in get_products:
-            prod_id = get_prod.get("product_id")
-            free_qty_per_set = get_prod.get("quantity")
-            total_free_qty = free_qty_per_set * applicable_times
-            
-            # Get price from cart if available, otherwise from coupon definition
-            price = None
-            if prod_id in cart_map:
-                price = cart_map[prod_id].price
-                actual_free_qty = min(total_free_qty, cart_map[prod_id].quantity)
-            elif "price" in get_prod:
-                price = get_prod.get("price")
-                actual_free_qty = total_free_qty
-            
-            if price:
-                total_discount += price * actual_free_qty
+    @staticmethod
+    def _calculate_cart_wise_discount(cart_total: float, details: Dict) -> float:
+        """Calculate discount for cart-wise coupon"""
+        threshold = details.get("threshold", 0)
+        discount_percent = details.get("discount", 0)
+        if cart_total >= threshold:
+            return (cart_total * discount_percent) / 100
+        return 0.0
 
-        return total_discount
+    @staticmethod
+    def _malformed_rule_discount(
+        coupon: Union[Coupon, Row], cart_map: Dict[int, CartItem], cart_total: float
+    ) -> float:
+        """
+        Fallback for rows whose rule parameters don't fit the columnar arrays (e.g. non-numeric values
+        written outside the API), computed with the plain per-coupon arithmetic; valid coupons never get here
+        """
+        details = coupon.details
+        if coupon.type == "cart-wise":
+            return CouponService._calculate_cart_wise_discount(cart_total, details)
+        if coupon.type == "product-wise":
+            item = cart_map.get(details.get("product_id"))
+            if item is not None:
+                return (item.price * item.quantity * details.get("discount", 0)) / 100
+        return 0.0
 
     @staticmethod
-    def get_applicable_coupons(db: Session, cart: Cart) -> List[ApplicableCoupon]:
-        """Get all applicable coupons for a cart with calculated discounts"""
-        try:
-            coupons = db.query(Coupon).all()
-            applicable = []
+    def _count_buy_sets(cart_map: Dict[int, CartItem], buy_ids: List[int], required: np.ndarray) -> int:
+        """Sum of complete buy sets over aligned buy product IDs and required quantities"""
+        available = np.array([
+            cart_map[product_id].quantity if product_id in cart_map else 0 for product_id in buy_ids
+        ], dtype=np.int64)
+        return int((available // required).sum())
+
+    @staticmethod
+    def _cart_map_key(cart_map: Dict[int, CartItem]) -> CartKey:
+        """Hashable signature of the effective cart (one line per product)"""
+        return tuple((item.product_id, item.quantity, item.price) for item in cart_map.values())
+
+    @staticmethod
+    def _cart_key(cart: Cart) -> CartKey:
+        """Hashable signature of a cart's contents"""
+        return tuple((item.product_id, item.quantity, item.price) for item in cart.items)
 
-            for coupon in coupons:
-                if not CouponService._is_coupon_valid(coupon):
+    @staticmethod
+    def _coupon_columns(coupons: Sequence[Union[Coupon, Row]]) -> CouponColumns:
+        """Split coupons into columnar cart-wise/product-wise parameters, BxGy rule keys and malformed leftovers"""
+        cart_wise, thresholds, cart_wise_percents = [], [], []
+        product_wise, product_ids, product_wise_percents = [], [], []
+        bxgy, others = [], []
+        for position, coupon in enumerate(coupons):
+            details = coupon.details
+            if coupon.type == "cart-wise":
+                threshold = details.get("threshold", 0)
+                discount_percent = details.get("discount", 0)
+                if _is_number(threshold) and _is_number(discount_percent):
+                    cart_wise.append(position)
+                    thresholds.append(threshold)
+                    cart_wise_percents.append(discount_percent)
+                    continue
+            elif coupon.type == "product-wise":
+                product_id = details.get("product_id")
+                discount_percent = details.get("discount", 0)
+                if isinstance(product_id, int) and not isinstance(product_id, bool) and _is_number(discount_percent):
+                    product_wise.append(position)
+                    product_ids.append(product_id)
+                    product_wise_percents.append(discount_percent)
                     continue
+            elif coupon.type == "bxgy":
+                bxgy.append((position, CouponService._bxgy_rule_key(details, coupon.repetition_limit or 1)))
+                continue
+            # Malformed parameters (or an unknown type) fall back to per-coupon arithmetic
+            others.append(position)
+
+        return CouponColumns(
+            cart_wise=np.array(cart_wise, dtype=np.intp),
+            thresholds=np.array(thresholds, dtype=np.float64),
+            cart_wise_percents=np.array(cart_wise_percents, dtype=np.float64),
+            product_wise=np.array(product_wise, dtype=np.intp),
+            product_ids=np.array(product_ids, dtype=np.int64),
+            product_wise_percents=np.array(product_wise_percents, dtype=np.float64),
+            bxgy=tuple(bxgy),
+            others=tuple(others)
+        )
+
+    @staticmethod
+    def _line_totals_for(cart_ids: np.ndarray, line_totals: np.ndarray, wanted_ids: np.ndarray) -> np.ndarray:
+        """Line total of each wanted product in the cart (0 when absent; the last line wins, as in the cart map)"""
+        if len(cart_ids) == 0 or len(wanted_ids) == 0:
+            return np.zeros(len(wanted_ids), dtype=np.float64)
+        unique_ids, last_lines = np.unique(cart_ids[::-1], return_index=True)
+        unique_totals = line_totals[::-1][last_lines]
+        positions = np.minimum(np.searchsorted(unique_ids, wanted_ids), len(unique_ids) - 1)
+        return np.where(unique_ids[positions] == wanted_ids, unique_totals[positions], 0.0)
+
+    @staticmethod
+    def _cart_discounts(
+        coupons: Sequence[Union[Coupon, Row]], cart: Cart, columns: Optional[CouponColumns] = None
+    ) -> Tuple[Tuple[Union[Coupon, Row], float], ...]:
+        """Coupons that give this cart a positive discount, with the (unrounded) discount"""
+        if columns is None:
+            columns = CouponService._coupon_columns(coupons)
+
+        # Cart arrays shared by every coupon evaluation
+        product_ids, prices, quantities = CouponService._cart_arrays(cart)
+        item_totals = prices * quantities
+        cart_total = CouponService._cart_total(item_totals)
+        discounts = np.zeros(len(coupons), dtype=np.float64)
+
+        # Cart-wise: a percentage off the cart total once it reaches the threshold
+        discounts[columns.cart_wise] = np.where(
+            cart_total >= columns.thresholds, cart_total * columns.cart_wise_percents / 100, 0.0
+        )
+        # Product-wise: a percentage off the product's line total
+        discounts[columns.product_wise] = CouponService._line_totals_for(
+            product_ids, item_totals, columns.product_ids
+        ) * columns.product_wise_percents / 100
+
+        if columns.bxgy or columns.others:
+            cart_map = CouponService._build_cart_map(cart)
+            # BxGy: memoized plans, all looked up with one cart signature
+            if columns.bxgy:
+                cart_key = CouponService._cart_map_key(cart_map)
+                for position, rule_key in columns.bxgy:
+                    discounts[position] = CouponService._compute_bxgy_plan(cart_key, rule_key).discount
+            for position in columns.others:
+                discounts[position] = CouponService._malformed_rule_discount(coupons[position], cart_map, cart_total)
+
+        return tuple((coupons[position], float(discounts[position])) for position in np.flatnonzero(discounts > 0))
 
-                discount = 0.0
-                if coupon.type == "cart-wise":
-                    discount = CouponService._calculate_cart_wise_discount(cart, coupon.details)
-                elif coupon.type == "product-wise":
-                    discount = CouponService._calculate_product_wise_discount(cart, coupon.details)
-                elif coupon.type == "bxgy":
-                    discount = CouponService._calculate_bxgy_discount(
-                        cart, coupon.details, coupon.repetition_limit or 1
-                    )
-
-                if discount > 0:
-                    applicable.append(ApplicableCoupon(
-                        coupon_id=coupon.id,
-                        type=coupon.type,
-                        discount=round(discount, 2)
-                    ))
-
-            return applicable
+    @staticmethod
+    @lru_cache(maxsize=APPLICABLE_CACHE_SIZE)
+    def _memoized_cart_discounts(coupons: Tuple[Coupon, ...], cart_key: CartKey) -> Tuple[Tuple[Coupon, float], ...]:
+        """_cart_discounts memoized per (parsed snapshot, cart contents), which fully determine the result"""
+        cart = Cart.model_construct(items=[
+            CartItem.model_construct(product_id=product_id, quantity=quantity, price=price)
+            for product_id, quantity, price in cart_key
+        ])
+        return CouponService._cart_discounts(coupons, cart, CouponService._snapshot_columns(coupons))
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _snapshot_columns(coupons: Tuple[Coupon, ...]) -> CouponColumns:
+        """Columnar view of the parsed snapshot, built once and reused for every cart until it changes"""
+        return CouponService._coupon_columns(coupons)
+
+    @staticmethod
+    async def get_applicable_coupons(
+        db: AsyncSession, cart: Cart, cache: Optional[Redis] = None
+    ) -> List[ApplicableCoupon]:
+        """Get all applicable coupons for a cart with calculated discounts"""
+        try:
+            coupons = await CouponService._get_active_coupons(
+                db, cache, [item.product_id for item in cart.items]
+            )
+            if cache is not None:
+                # Snapshot coupons are shared, long-lived objects, so discounts can be memoized per cart
+                candidates = CouponService._memoized_cart_discounts(coupons, CouponService._cart_key(cart))
+            else:
+                candidates = CouponService._cart_discounts(coupons, cart)
+
+            # Validity depends on the clock and live usage counters, so it is checked on every call
+            uses = await get_coupon_uses(
+                cache, [coupon.id for coupon, _ in candidates if coupon.repetition_limit]
+            )
+            now = get_ist_time()
+            return [
+                ApplicableCoupon(
+                    coupon_id=coupon.id,
+                    type=coupon.type,
+                    discount=round(discount, 2)
+                )
+                for coupon, discount in candidates
+                if CouponService._is_coupon_valid(coupon, uses.get(coupon.id), now)
+            ]
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     @staticmethod
-    def apply_coupon(db: Session, coupon_id: int, cart: Cart) -> UpdatedCart:
+    async def apply_coupon(
+        db: AsyncSession, coupon_id: int, cart: Cart, cache: Optional[Redis] = None
+    ) -> UpdatedCart:
         """Apply a specific coupon to cart and return updated cart"""
         try:
-            coupon = db.query(Coupon).filter(Coupon.id == coupon_id).first()
+            coupon = await db.get(Coupon, coupon_id)
             
             if not coupon:
                 raise HTTPException(status_code=404, detail="Coupon not found")
 
-            if not CouponService._is_coupon_valid(coupon):
+            # One clock reading serves both the validity check and the usage update
+            now = get_ist_time()
+            if not CouponService._is_coupon_valid(coupon, now=now):
                 raise HTTPException(status_code=400, detail="Coupon is not valid or has expired")
-            
-            # Increment usage counter
-            coupon.times_used += 1
-            db.flush()  # Flush changes without committing
         except HTTPException:
             raise
         except Exception as e:
@@ -286,18 +802,21 @@ class CouponService:
         total_discount = 0.0
         updated_items = []
 
+        # Vectorized view of the cart, built once per request
+        product_ids, prices, quantities = CouponService._cart_arrays(cart)
+        item_totals = prices * quantities
+        cart_total = CouponService._cart_total(item_totals)
+
         if coupon.type == "cart-wise":
-            total_discount = CouponService._calculate_cart_wise_discount(cart, coupon.details)
+            total_discount = CouponService._calculate_cart_wise_discount(cart_total, coupon.details)
             
             if total_discount == 0:
                 raise HTTPException(status_code=400, detail="Cart does not meet coupon conditions")
             
             # Distribute discount proportionally across items
-            cart_total = CouponService._calculate_cart_total(cart)
-            for item in cart.items:
-                item_total = item.price * item.quantity
-                item_discount = (item_total / cart_total) * total_discount
-                updated_items.append(UpdatedCartItem(
+            item_discounts = item_totals * (total_discount / cart_total)
+            for item, item_discount in zip(cart.items, item_discounts.tolist()):
+                updated_items.append(UpdatedCartItem.model_construct(
                     product_id=item.product_id,
                     quantity=item.quantity,
                     price=item.price,
@@ -308,19 +827,15 @@ class CouponService:
             product_id = coupon.details.get("product_id")
             discount_percent = coupon.details.get("discount", 0)
             
-            # Create cart lookup
-            cart_map = {item.product_id: item for item in cart.items}
-            
-            if product_id not in cart_map:
+            matches = product_ids == product_id
+            if not matches.any():
                 raise HTTPException(status_code=400, detail="Product not found in cart")
             
-            for item in cart.items:
-                item_discount = 0.0
-                if item.product_id == product_id:
-                    item_discount = (item.price * item.quantity * discount_percent) / 100
-                    total_discount = item_discount
-                
-                updated_items.append(UpdatedCartItem(
+            item_discounts = np.where(matches, item_totals * discount_percent / 100, 0.0)
+            # As in the listing, a product repeated across cart lines is discounted by its last line
+            total_discount = float(item_discounts[np.flatnonzero(matches)[-1]])
+            for item, item_discount in zip(cart.items, item_discounts.tolist()):
+                updated_items.append(UpdatedCartItem.model_construct(
                     product_id=item.product_id,
                     quantity=item.quantity,
                     price=item.price,
@@ -328,44 +843,20 @@ class CouponService:
                 ))
 
         elif coupon.type == "bxgy":
-            buy_products = coupon.details.get("buy_products", [])
-            get_products = coupon.details.get("get_products", [])
-            repetition_limit = coupon.repetition_limit or 1
-
-            # Create cart lookup
-            cart_map = {item.product_id: item for item in cart.items}
-
-            # Calculate total sets available from all buy products (OR logic)
-            total_buy_sets = 0
-            for buy_prod in buy_products:
-                prod_id = buy_prod.get("product_id")
-                required_qty = buy_prod.get("quantity")
-                
-                if prod_id in cart_map:
-                    sets_from_this_product = cart_map[prod_id].quantity // required_qty
-                    total_buy_sets += sets_from_this_product
+            cart_map = CouponService._build_cart_map(cart)
+            plan = CouponService._compute_bxgy_plan(
+                CouponService._cart_map_key(cart_map),
+                CouponService._bxgy_rule_key(coupon.details, coupon.repetition_limit or 1)
+            )
 
-            if total_buy_sets == 0:
+            if plan.buy_sets == 0:
                 raise HTTPException(status_code=400, detail="Buy products not found in cart")
-            
-            # Apply repetition limit
-            applicable_times = min(total_buy_sets, repetition_limit)
 
-            # Calculate free quantities and track prices
-            free_quantities = {}
-            get_product_prices = {}
-            
-            for get_prod in get_products:
-                prod_id = get_prod.get("product_id")
-                free_qty_per_set = get_prod.get("quantity")
-                total_free_qty = free_qty_per_set * applicable_times
-                free_quantities[prod_id] = total_free_qty
-                
-                # Get price from cart if available, otherwise from coupon definition
-                if prod_id in cart_map:
-                    get_product_prices[prod_id] = cart_map[prod_id].price
-                elif "price" in get_prod:
-                    get_product_prices[prod_id] = get_prod.get("price")
+            # Free quantities and their prices (cart price, else the coupon's own price)
+            free_quantities = {prod_id: free_qty for prod_id, free_qty, _ in plan.free_items}
+            get_product_prices = {
+                prod_id: price for prod_id, _, price in plan.free_items if price is not None
+            }
             
             # Build updated items - add free quantities to existing cart items
             cart_product_ids = set()
@@ -381,7 +872,7 @@ class CouponService:
                     # Add free items to quantity
                     item_quantity += free_qty
                 
-                updated_items.append(UpdatedCartItem(
+                updated_items.append(UpdatedCartItem.model_construct(
                     product_id=item.product_id,
                     quantity=item_quantity,
                     price=item.price,
@@ -397,7 +888,7 @@ class CouponService:
                         item_discount = price * free_qty
                         total_discount += item_discount
                         
-                        updated_items.append(UpdatedCartItem(
+                        updated_items.append(UpdatedCartItem.model_construct(
                             product_id=prod_id,
                             quantity=free_qty,
                             price=price,
@@ -408,11 +899,12 @@ class CouponService:
         # For BxGy, total_price includes free items
         if coupon.type == "bxgy":
             cart_total = sum(item.price * item.quantity for item in updated_items)
-        else:
-            cart_total = CouponService._calculate_cart_total(cart)
         
         final_price = cart_total - total_discount
 
+        # Only count the use once the cart is known to qualify
+        await CouponService._record_coupon_use(db, coupon, cache, now)
+
         return UpdatedCart(
             items=updated_items,
             total_price=round(cart_total, 2),
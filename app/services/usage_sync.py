@@ -0,0 +1,36 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.core import get_settings
+from app.db import get_sessionmaker
+from app.db.cache import get_redis_client
+from app.services.coupon_service import CouponService
+
+logger = logging.getLogger(__name__)
+
+
+async def flush_usage_counters() -> int:
+    """Write all pending Redis usage counters back to the database"""
+    cache = get_redis_client()
+    if cache is None:
+        return 0
+
+    flushed = 0
+    async with get_sessionmaker()() as db:
+        while True:
+            count = await CouponService.flush_usage_counters(db, cache)
+            if not count:
+                return flushed
+            flushed += count
+
+
+async def run_usage_flusher(interval: Optional[float] = None):
+    """Background task that periodically persists Redis usage counters to coupons.times_used"""
+    interval = interval or get_settings().usage_flush_interval
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_usage_counters()
+        except Exception:
+            logger.exception("Failed to write coupon usage counters back to the database")
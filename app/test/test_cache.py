@@ -0,0 +1,44 @@
+"""
+Unit tests for the Redis usage counters
+Run with: pytest app/test/test_cache.py
+"""
+import asyncio
+import pytest
+from app.db.cache import reserve_coupon_use, coupon_uses_key
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # Lua scripting support for fakeredis
+
+
+def reserve(cache, times_used, repetition_limit):
+    """Reserve one use of coupon 1 with the given database state"""
+    return asyncio.run(reserve_coupon_use(cache, 1, times_used, repetition_limit))
+
+
+class TestReserveCouponUse:
+    """Test cases for the atomic usage reservation script"""
+
+    def test_seeds_missing_counter_from_database(self):
+        """Test the first reservation starts from the database count"""
+        cache = fakeredis.FakeAsyncRedis()
+        assert reserve(cache, times_used=2, repetition_limit=5) == 3
+
+    def test_raises_stale_counter_to_database_count(self):
+        """Test uses counted in the database during a Redis outage aren't handed out again"""
+        cache = fakeredis.FakeAsyncRedis()
+        asyncio.run(cache.set(coupon_uses_key(1), 1))
+        # Two more uses were recorded in the database while Redis was unreachable
+        assert reserve(cache, times_used=3, repetition_limit=4) == 4
+        assert reserve(cache, times_used=3, repetition_limit=4) == -1
+
+    def test_keeps_counter_ahead_of_database(self):
+        """Test uses not yet written back to the database are kept"""
+        cache = fakeredis.FakeAsyncRedis()
+        asyncio.run(cache.set(coupon_uses_key(1), 4))
+        assert reserve(cache, times_used=1, repetition_limit=None) == 5
+
+    def test_rejects_when_limit_reached(self):
+        """Test a reservation at the repetition limit is refused without counting"""
+        cache = fakeredis.FakeAsyncRedis()
+        assert reserve(cache, times_used=2, repetition_limit=2) == -1
+        assert asyncio.run(cache.get(coupon_uses_key(1))) == b"2"
@@ -2,61 +2,86 @@
 Unit tests for coupon service
 Run with: pytest app/test/test_coupon_service.py
 """
+import asyncio
+from datetime import datetime, timezone
+import numpy as np
+import orjson
 import pytest
+from fastapi import HTTPException
 from app.services.coupon_service import CouponService
-from app.models.schemas import Cart, CartItem
+from app.models.coupon import Coupon, IST
+from app.models.schemas import Cart, CartItem, CouponCreate, CouponResponse, CouponUpdate
+
+
+def coupon_discount(cart, coupon_type, details, repetition_limit=None):
+    """Discount a single coupon gives the cart through the applicable-coupons path (0 when it doesn't apply)"""
+    coupon = Coupon(id=1, type=coupon_type, details=details, repetition_limit=repetition_limit)
+    discounts = CouponService._cart_discounts((coupon,), cart)
+    return discounts[0][1] if discounts else 0.0
 
 
 class TestCouponService:
     """Test cases for CouponService"""
 
-    def test_calculate_cart_total(self):
+    def test_cart_total(self):
         """Test cart total calculation"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=2, price=50.0),
             CartItem(product_id=2, quantity=3, price=30.0),
         ])
-        total = CouponService._calculate_cart_total(cart)
+        _, prices, quantities = CouponService._cart_arrays(cart)
+        total = CouponService._cart_total(prices * quantities)
         assert total == 190.0
 
-    def test_calculate_cart_wise_discount_above_threshold(self):
+    def test_cart_wise_discount_above_threshold(self):
         """Test cart-wise discount when cart meets threshold"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=2, price=60.0),
         ])
         details = {"threshold": 100, "discount": 10}
-        discount = CouponService._calculate_cart_wise_discount(cart, details)
+        discount = coupon_discount(cart, "cart-wise", details)
         assert discount == 12.0  # 10% of 120
 
-    def test_calculate_cart_wise_discount_below_threshold(self):
+    def test_cart_wise_discount_below_threshold(self):
         """Test cart-wise discount when cart is below threshold"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=1, price=50.0),
         ])
         details = {"threshold": 100, "discount": 10}
-        discount = CouponService._calculate_cart_wise_discount(cart, details)
+        discount = coupon_discount(cart, "cart-wise", details)
         assert discount == 0.0
 
-    def test_calculate_product_wise_discount(self):
+    def test_product_wise_discount(self):
         """Test product-wise discount calculation"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=2, price=50.0),
             CartItem(product_id=2, quantity=3, price=30.0),
         ])
         details = {"product_id": 1, "discount": 20}
-        discount = CouponService._calculate_product_wise_discount(cart, details)
+        discount = coupon_discount(cart, "product-wise", details)
         assert discount == 20.0  # 20% of 100
 
-    def test_calculate_product_wise_discount_product_not_in_cart(self):
+    def test_product_wise_discount_duplicate_cart_lines(self):
+        """Test a product repeated across cart lines is discounted by its last line"""
+        cart = Cart(items=[
+            CartItem(product_id=1, quantity=2, price=50.0),
+            CartItem(product_id=2, quantity=3, price=30.0),
+            CartItem(product_id=1, quantity=1, price=40.0),
+        ])
+        details = {"product_id": 1, "discount": 25}
+        discount = coupon_discount(cart, "product-wise", details)
+        assert discount == 10.0  # 25% of the last line (1 x 40)
+
+    def test_product_wise_discount_product_not_in_cart(self):
         """Test product-wise discount when product not in cart"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=2, price=50.0),
         ])
         details = {"product_id": 99, "discount": 20}
-        discount = CouponService._calculate_product_wise_discount(cart, details)
+        discount = coupon_discount(cart, "product-wise", details)
         assert discount == 0.0
 
-    def test_calculate_bxgy_discount_basic(self):
+    def test_bxgy_discount_basic(self):
         """Test basic BxGy discount calculation"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=2, price=50.0),
@@ -66,10 +91,10 @@ class TestCouponService:
             "buy_products": [{"product_id": 1, "quantity": 2}],
             "get_products": [{"product_id": 3, "quantity": 1}],
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=1)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=1)
         assert discount == 25.0
 
-    def test_calculate_bxgy_discount_with_repetition(self):
+    def test_bxgy_discount_with_repetition(self):
         """Test BxGy discount with repetition limit"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=6, price=50.0),
@@ -79,10 +104,10 @@ class TestCouponService:
             "buy_products": [{"product_id": 1, "quantity": 2}],
             "get_products": [{"product_id": 3, "quantity": 1}],
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=3)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=3)
         assert discount == 75.0  # 3 free items at $25 each
 
-    def test_calculate_bxgy_discount_insufficient_buy_products(self):
+    def test_bxgy_discount_insufficient_buy_products(self):
         """Test BxGy when cart doesn't have enough buy products"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=1, price=50.0),
@@ -92,10 +117,10 @@ class TestCouponService:
             "buy_products": [{"product_id": 1, "quantity": 2}],
             "get_products": [{"product_id": 3, "quantity": 1}],
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=1)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=1)
         assert discount == 0.0
 
-    def test_calculate_bxgy_discount_limited_get_products(self):
+    def test_bxgy_discount_limited_get_products(self):
         """Test BxGy when cart has fewer get products than eligible"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=6, price=50.0),
@@ -105,11 +130,11 @@ class TestCouponService:
             "buy_products": [{"product_id": 1, "quantity": 2}],
             "get_products": [{"product_id": 3, "quantity": 1}],
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=5)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=5)
         # Can apply 3 times (6/2), but only 2 get products available
         assert discount == 50.0  # 2 items at $25 each
 
-    def test_calculate_bxgy_discount_with_price_in_coupon(self):
+    def test_bxgy_discount_with_price_in_coupon(self):
         """Test BxGy when get product is not in cart but has price in coupon"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=6, price=50.0),
@@ -119,11 +144,11 @@ class TestCouponService:
             "buy_products": [{"product_id": 1, "quantity": 2}],
             "get_products": [{"product_id": 3, "quantity": 1, "price": 25.0}],  # Price in coupon
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=3)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=3)
         # Can apply 3 times (6/2), get 3 free items at $25 each
         assert discount == 75.0  # 3 items at $25 each
 
-    def test_calculate_bxgy_discount_mixed_sources(self):
+    def test_bxgy_discount_mixed_sources(self):
         """Test BxGy with price from both cart and coupon"""
         cart = Cart(items=[
             CartItem(product_id=1, quantity=4, price=50.0),
@@ -136,8 +161,199 @@ class TestCouponService:
                 {"product_id": 4, "quantity": 1, "price": 20.0}   # Product 4 not in cart
             ],
         }
-        discount = CouponService._calculate_bxgy_discount(cart, details, repetition_limit=2)
+        discount = coupon_discount(cart, "bxgy", details, repetition_limit=2)
         # Can apply 2 times (4/2)
         # Product 3: 1 in cart, need 2 free, so only 1 free at cart price $30
         # Product 4: 0 in cart, need 2 free, so 2 free at coupon price $20 each
         assert discount == 70.0  # (1 × $30) + (2 × $20)
+
+    def test_count_bxgy_buy_sets_across_buy_products(self):
+        """Test buy sets are summed across buy products (OR logic)"""
+        cart = Cart(items=[
+            CartItem(product_id=1, quantity=7, price=50.0),
+            CartItem(product_id=2, quantity=3, price=30.0),
+        ])
+        buy_ids = [1, 2, 5]  # Product 5 is not in the cart
+        required = np.array([3, 3, 1])
+        cart_map = CouponService._build_cart_map(cart)
+        sets = CouponService._count_buy_sets(cart_map, buy_ids, required)
+        assert sets == 3  # 7 // 3 + 3 // 3
+
+    def test_cart_discounts_skips_coupons_without_discount(self):
+        """Test only coupons giving a positive discount are returned"""
+        cart = Cart(items=[
+            CartItem(product_id=1, quantity=2, price=50.0),
+        ])
+        cart_wise = Coupon(id=1, type="cart-wise", details={"threshold": 50, "discount": 10})
+        other_product = Coupon(id=2, type="product-wise", details={"product_id": 99, "discount": 20})
+        discounts = CouponService._cart_discounts((cart_wise, other_product), cart)
+        assert discounts == ((cart_wise, 10.0),)
+
+    def test_cart_discounts_threshold_matches_cart_total(self):
+        """Test a cart totalling exactly the threshold qualifies, using the same total as apply"""
+        prices = [10.96, 40.17, 27.81, 15.1, 5.49, 40.1, 16.54, 12.86, 10.01, 41.25]
+        quantities = [1, 3, 3, 2, 2, 1, 1, 3, 1, 1]
+        cart = Cart(items=[
+            CartItem(product_id=i + 1, quantity=quantity, price=price)
+            for i, (price, quantity) in enumerate(zip(prices, quantities))
+        ])
+        _, prices, quantities = CouponService._cart_arrays(cart)
+        assert CouponService._cart_total(prices * quantities) == 402.56
+        coupon = Coupon(id=1, type="cart-wise", details={"threshold": 402.56, "discount": 10})
+        discounts = CouponService._cart_discounts((coupon,), cart)
+        assert [c for c, _ in discounts] == [coupon]
+
+    def test_skipped_codes_reports_existing_and_repeated_codes(self):
+        """Test bulk creation reports every request entry that wasn't inserted, in request order"""
+        def coupon_data(code):
+            return CouponCreate(code=code, type="cart-wise", details={"threshold": 10, "discount": 5})
+
+        requested = [coupon_data(code) for code in ("NEW1", "TAKEN", "NEW2", "NEW1", "TAKEN")]
+        created = [CouponResponse.model_construct(code="NEW1"), CouponResponse.model_construct(code="NEW2")]
+        assert CouponService._skipped_codes(requested, created) == ["TAKEN", "NEW1", "TAKEN"]
+
+    def test_skipped_codes_when_everything_is_created(self):
+        """Test nothing is skipped when every code was inserted"""
+        requested = [
+            CouponCreate(code="ONLY1", type="cart-wise", details={"threshold": 10, "discount": 5})
+        ]
+        created = [CouponResponse.model_construct(code="ONLY1")]
+        assert CouponService._skipped_codes(requested, created) == []
+
+    def test_new_snapshot_clears_memoized_discounts(self):
+        """Test memoized cart discounts don't outlive the snapshot they were computed for"""
+        def snapshot(discount):
+            return orjson.dumps([{
+                "id": 1, "type": "cart-wise", "details": {"threshold": 10, "discount": discount},
+                "expires_at": None, "repetition_limit": None, "times_used": 0,
+            }])
+
+        cart = Cart(items=[CartItem(product_id=1, quantity=1, price=100.0)])
+        coupons = CouponService._snapshot_coupons(snapshot(10))
+        discounts = CouponService._memoized_cart_discounts(coupons, CouponService._cart_key(cart))
+        assert [discount for _, discount in discounts] == [10.0]
+        assert CouponService._memoized_cart_discounts.cache_info().currsize == 1
+
+        CouponService._snapshot_coupons(snapshot(20))
+        assert CouponService._memoized_cart_discounts.cache_info().currsize == 0
+
+    def test_cart_discounts_mixed_coupon_types(self):
+        """Test cart-wise, product-wise and BxGy coupons are evaluated together, in coupon order"""
+        cart = Cart(items=[
+            CartItem(product_id=1, quantity=4, price=50.0),
+            CartItem(product_id=2, quantity=1, price=20.0),
+            CartItem(product_id=3, quantity=1, price=25.0),
+        ])
+        coupons = (
+            Coupon(id=1, type="product-wise", details={"product_id": 2, "discount": 50}),
+            Coupon(id=2, type="cart-wise", details={"threshold": 500, "discount": 10}),  # Below threshold
+            Coupon(id=3, type="bxgy", repetition_limit=2, details={
+                "buy_products": [{"product_id": 1, "quantity": 2}],
+                "get_products": [{"product_id": 3, "quantity": 1}],
+            }),
+            Coupon(id=4, type="cart-wise", details={"threshold": 100, "discount": 10}),
+            Coupon(id=5, type="product-wise", details={"product_id": 99, "discount": 20}),  # Not in cart
+        )
+        discounts = CouponService._cart_discounts(coupons, cart)
+        # BxGy: 2 sets earn 2 free units of product 3, capped at the 1 in the cart
+        assert [(coupon.id, discount) for coupon, discount in discounts] == [(1, 10.0), (3, 25.0), (4, 24.5)]
+
+    def test_cart_discounts_malformed_rules_fall_back(self):
+        """Test rows whose parameters don't fit the arrays still get the per-coupon discount"""
+        cart = Cart(items=[CartItem(product_id=2, quantity=2, price=20.0)])
+        coupons = (
+            Coupon(id=1, type="product-wise", details={"product_id": 2.0, "discount": 50}),
+            Coupon(id=2, type="unknown", details={}),
+            Coupon(id=3, type="cart-wise", details={"threshold": 10, "discount": 10}),
+        )
+        columns = CouponService._coupon_columns(coupons)
+        assert columns.others == (0, 1)
+        discounts = CouponService._cart_discounts(coupons, cart, columns)
+        assert [(coupon.id, discount) for coupon, discount in discounts] == [(1, 20.0), (3, 4.0)]
+
+    def test_to_response_reports_timestamps_in_utc(self):
+        """Test unrefreshed IST timestamps serialize in UTC, like rows read back from the database"""
+        ist = datetime(2030, 1, 1, 10, 0, tzinfo=IST)
+        coupon = Coupon(
+            id=1, code="SAVE10", type="cart-wise", details={}, created_at=ist, updated_at=ist,
+            expires_at=ist, is_active=True, repetition_limit=None, times_used=0
+        )
+        response = CouponService._to_response(coupon)
+        assert response.created_at == ist and response.created_at.tzinfo == timezone.utc
+        assert response.expires_at == datetime(2030, 1, 1, 4, 30, tzinfo=timezone.utc)
+
+
+class FakeSession:
+    """Just enough of an AsyncSession for update_coupon: one stored coupon, a no-op flush"""
+
+    def __init__(self, coupon):
+        self.coupon = coupon
+
+    async def get(self, model, coupon_id):
+        return self.coupon if coupon_id == self.coupon.id else None
+
+    async def flush(self):
+        # Stand in for the value the UPDATE would return
+        self.coupon.updated_at = datetime.now(timezone.utc)
+
+
+def stored_coupon(coupon_type, details, repetition_limit=None):
+    """A coupon as loaded from the database"""
+    now = datetime.now(timezone.utc)
+    return Coupon(
+        id=1, code="COUPON1", type=coupon_type, details=details, created_at=now, updated_at=now,
+        expires_at=None, is_active=True, repetition_limit=repetition_limit, times_used=0
+    )
+
+
+def update(coupon, **changes):
+    """Run update_coupon against a session holding the given coupon"""
+    return asyncio.run(CouponService.update_coupon(FakeSession(coupon), coupon.id, CouponUpdate(**changes)))
+
+
+class TestUpdateCouponRepetitionLimit:
+    """Test cases for repetition limits on coupon updates"""
+
+    BXGY_DETAILS = {
+        "buy_products": [{"product_id": 1, "quantity": 2}],
+        "get_products": [{"product_id": 3, "quantity": 1}],
+    }
+
+    def test_limit_alone_on_bxgy_coupon(self):
+        """Test a repetition_limit sent without details updates a BxGy coupon's limit"""
+        coupon = stored_coupon("bxgy", self.BXGY_DETAILS, repetition_limit=1)
+        assert update(coupon, repetition_limit=4).repetition_limit == 4
+
+    def test_limit_alone_on_cart_wise_coupon_is_rejected(self):
+        """Test a repetition_limit can't be set on a coupon that stays cart-wise"""
+        coupon = stored_coupon("cart-wise", {"threshold": 100, "discount": 10})
+        with pytest.raises(HTTPException) as error:
+            update(coupon, repetition_limit=4)
+        assert error.value.status_code == 400
+
+    def test_type_change_to_bxgy_with_limit(self):
+        """Test a limit sent along with a change to BxGy is applied"""
+        coupon = stored_coupon("cart-wise", {"threshold": 100, "discount": 10})
+        response = update(coupon, type="bxgy", repetition_limit=3)
+        assert (response.type, response.repetition_limit) == ("bxgy", 3)
+
+    def test_type_change_to_bxgy_with_limit_in_details(self):
+        """Test repition_limit in the new BxGy details is kept"""
+        coupon = stored_coupon("cart-wise", {"threshold": 100, "discount": 10})
+        response = update(coupon, type="bxgy", details={**self.BXGY_DETAILS, "repition_limit": 3})
+        assert (response.type, response.repetition_limit) == ("bxgy", 3)
+        assert "repition_limit" not in response.details
+
+    def test_type_change_to_bxgy_defaults_limit(self):
+        """Test changing to BxGy without a limit gives the BxGy default of 1"""
+        coupon = stored_coupon("cart-wise", {"threshold": 100, "discount": 10})
+        response = update(coupon, type="bxgy", details=self.BXGY_DETAILS)
+        assert response.repetition_limit == 1
+
+    def test_type_change_from_bxgy_clears_limit(self):
+        """Test a coupon that stops being BxGy loses its repetition limit"""
+        coupon = stored_coupon("bxgy", self.BXGY_DETAILS, repetition_limit=3)
+        response = update(coupon, type="cart-wise", details={"threshold": 100, "discount": 10})
+        assert (response.type, response.repetition_limit) == ("cart-wise", None)
+        coupon = stored_coupon("bxgy", self.BXGY_DETAILS, repetition_limit=3)
+        assert update(coupon, type="product-wise").repetition_limit is None
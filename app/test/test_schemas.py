@@ -0,0 +1,72 @@
+"""
+Unit tests for request schemas
+Run with: pytest app/test/test_schemas.py
+"""
+import pytest
+from datetime import datetime, timezone
+from pydantic import ValidationError
+from app.models.coupon import IST
+from app.models.schemas import CouponCreate, CouponUpdate
+
+BXGY_DETAILS = {
+    "buy_products": [{"product_id": 1, "quantity": 2}],
+    "get_products": [{"product_id": 3, "quantity": 1}],
+}
+
+
+class TestCouponSchemas:
+    """Test cases for coupon request parsing"""
+
+    def test_create_bxgy_moves_repetition_limit_out_of_details(self):
+        """Test repition_limit is split out of BxGy details"""
+        details = {**BXGY_DETAILS, "repition_limit": 3}
+        coupon = CouponCreate(code="BUY2GET1", type="bxgy", details=details)
+        assert coupon.repetition_limit == 3
+        assert "repition_limit" not in coupon.details
+        assert "repition_limit" in details  # The request payload itself is left untouched
+
+    def test_create_bxgy_defaults_repetition_limit(self):
+        """Test BxGy coupons without a limit default to 1"""
+        coupon = CouponCreate(code="BUY2GET1", type="bxgy", details=BXGY_DETAILS)
+        assert coupon.repetition_limit == 1
+
+    @pytest.mark.parametrize("limit", [0, -3, "lots"])
+    def test_create_bxgy_rejects_invalid_repetition_limit(self, limit):
+        """Test repition_limit in details is validated like the repetition_limit field"""
+        with pytest.raises(ValidationError):
+            CouponCreate(code="BUY2GET1", type="bxgy", details={**BXGY_DETAILS, "repition_limit": limit})
+
+    def test_create_non_bxgy_has_no_repetition_limit(self):
+        """Test cart-wise coupons ignore any repetition limit"""
+        coupon = CouponCreate(
+            code="SAVE10", type="cart-wise", details={"threshold": 100, "discount": 10}, repetition_limit=5
+        )
+        assert coupon.repetition_limit is None
+
+    def test_update_moves_repetition_limit_out_of_details(self):
+        """Test repition_limit is split out of updated details"""
+        coupon = CouponUpdate(details={**BXGY_DETAILS, "repition_limit": 2})
+        assert coupon.repetition_limit == 2
+        assert "repition_limit" not in coupon.details
+
+    def test_update_rejects_invalid_repetition_limit(self):
+        """Test an invalid repition_limit in updated details is rejected"""
+        with pytest.raises(ValidationError):
+            CouponUpdate(details={**BXGY_DETAILS, "repition_limit": -3})
+
+    def test_update_keeps_top_level_repetition_limit(self):
+        """Test a repetition_limit sent without details is kept as set"""
+        coupon = CouponUpdate(repetition_limit=4)
+        assert coupon.model_dump(exclude_unset=True) == {"repetition_limit": 4}
+
+    def test_naive_expires_at_is_read_as_ist(self):
+        """Test naive expiry times are pinned to IST rather than the server's local zone"""
+        coupon = CouponCreate(code="BUY2GET1", type="bxgy", details=BXGY_DETAILS, expires_at="2026-10-20T10:00:00")
+        assert coupon.expires_at == datetime(2026, 10, 20, 10, 0, tzinfo=IST)
+        update = CouponUpdate(expires_at="2026-10-20T10:00:00")
+        assert update.expires_at == datetime(2026, 10, 20, 4, 30, tzinfo=timezone.utc)
+
+    def test_aware_expires_at_is_kept(self):
+        """Test expiry times with an explicit offset are left as sent"""
+        coupon = CouponUpdate(expires_at="2026-10-20T10:00:00Z")
+        assert coupon.expires_at == datetime(2026, 10, 20, 10, 0, tzinfo=timezone.utc)
@@ -1,15 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from app.router import router
-from app.db import init_db
+from app.db import init_db, close_db, close_redis
+from app.db.cache import get_redis_client
+from app.services import flush_usage_counters, run_usage_flusher
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize database
+    await init_db()
+
+    # Periodically persist Redis usage counters when caching is enabled
+    usage_flusher = asyncio.create_task(run_usage_flusher()) if get_redis_client() else None
+    yield
+    if usage_flusher is not None:
+        usage_flusher.cancel()
+        with suppress(asyncio.CancelledError):
+            await usage_flusher
+        await flush_usage_counters()
+
+    await close_redis()
+    await close_db()
+
 
 app = FastAPI(
     title="Coupon Management API",
     description="RESTful API for managing and applying discount coupons",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize database
-init_db()
+# Compress larger JSON payloads such as coupon listings
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 
 # Include routers
 app.include_router(router)